@@ -1,23 +1,78 @@
 \
-import os, json
+import os, time, sqlite3
 from datetime import datetime
 from urllib.parse import urlencode
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+import orjson
+from flask import Flask, render_template, request, redirect, url_for, flash, session, abort
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import joinedload
 from flask_bcrypt import Bcrypt
+from flask_caching import Cache
+from flask_session import Session
+from redis import Redis
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user, UserMixin
 from dotenv import load_dotenv
 
 load_dotenv()
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson; used for jsonify and the session cookie.
+
+    Unlike Flask's default provider, datetimes are written as ISO-8601 (orjson
+    handles them natively) rather than HTTP dates.
+    """
+
+    def dumps(self, obj, **kwargs):
+        # orjson output is always compact; indent/separators kwargs are ignored
+        option = orjson.OPT_SORT_KEYS if kwargs.get("sort_keys", self.sort_keys) else 0
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY","dev-secret-change-me")
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL","sqlite:///app.db")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    # JSON columns (Order.items_json) go through orjson instead of the stdlib
+    "json_serializer": lambda obj: orjson.dumps(obj).decode("utf-8"),
+    "json_deserializer": orjson.loads,
+}
+if not app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+    # per gunicorn worker; keeps connections (TLS + auth) reused across requests
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update(
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        pool_size=int(os.getenv("DB_POOL_SIZE","10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW","20")),
+    )
+app.config["BCRYPT_LOG_ROUNDS"] = int(os.getenv("BCRYPT_LOG_ROUNDS","12"))
+# With REDIS_URL set, the cart lives in Redis and the cookie only carries a session id;
+# otherwise Flask's signed-cookie sessions are used.
+if os.getenv("REDIS_URL"):
+    app.config["SESSION_TYPE"] = "redis"
+    app.config["SESSION_REDIS"] = Redis.from_url(os.getenv("REDIS_URL"))
+    Session(app)
+app.config["CACHE_TYPE"] = "RedisCache" if os.getenv("REDIS_URL") else "SimpleCache"
+app.config["CACHE_REDIS_URL"] = os.getenv("REDIS_URL")
+app.config["CACHE_DEFAULT_TIMEOUT"] = int(os.getenv("PAGE_CACHE_TTL","60"))
+
+# compiled templates are shared on disk, so each new worker skips parsing them
+# (without JINJA_CACHE_DIR, Jinja picks a per-user temp directory)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(os.getenv("JINJA_CACHE_DIR"))
 
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
+cache = Cache(app)
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 
@@ -34,6 +89,10 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return bcrypt.check_password_hash(self.password_hash, password)
 
+    def needs_rehash(self):
+        # bcrypt hashes look like $2b$<rounds>$...
+        return int(self.password_hash.split("$")[2]) != app.config["BCRYPT_LOG_ROUNDS"]
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
@@ -47,71 +106,187 @@ class Product(db.Model):
     category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=True)
     category = db.relationship(Category, backref="products")
 
+    __table_args__ = (
+        db.Index("ix_product_cat_id", "category_id", "id"),  # category filter + id DESC sort
+    )
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
-    items_json = db.Column(db.Text, nullable=False)  # list of {product_id, title, qty, price}
+    items_json = db.Column(db.JSON().with_variant(JSONB, "postgresql"), nullable=False)  # list of {product_id, title, qty, price}
     total = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_conn, conn_record):
+    # WAL lets readers run alongside the order/register writes and syncs less often
+    if isinstance(dbapi_conn, sqlite3.Connection):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA cache_size=-20000")
+        cur.close()
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
 # ------------------ Helpers ------------------
-def get_cart():
-    return session.setdefault("cart", {})  # {product_id: qty}
+# compared against on unknown-email logins so they take as long as real ones. Hashes at an
+# older BCRYPT_LOG_ROUNDS also pay this cost in login(); a *higher* old cost still answers
+# slower than unknown emails until those accounts log in and are rehashed.
+_DUMMY_HASH = bcrypt.generate_password_hash("x" * 16).decode("utf-8")
+
+# categories rarely change; keep (id, name) rows in-process instead of querying per hit
+CATEGORY_CACHE_TTL = int(os.getenv("CATEGORY_CACHE_TTL","300"))
+_category_cache = {"rows": [], "expires": 0.0}
+
+def get_categories():
+    now = time.monotonic()
+    if now >= _category_cache["expires"]:
+        _category_cache["rows"] = db.session.execute(
+            db.select(Category.id, Category.name).order_by(Category.name)
+        ).all()
+        _category_cache["expires"] = now + CATEGORY_CACHE_TTL
+    return _category_cache["rows"]
+
+def invalidate_categories():
+    # only resets this process; other gunicorn workers refresh when their TTL expires
+    _category_cache["expires"] = 0.0
+
+# Substring search over title/description. Postgres gets a trigram GIN index that
+# serves col ILIKE '%q%'; SQLite gets an FTS5 trigram shadow table kept in
+# sync by triggers. Both are created by init-db.
+_SEARCH_DDL = {
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_product_search_trgm ON product "
+        "USING gin (title gin_trgm_ops, description gin_trgm_ops)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+        "title, description, content='product', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN "
+        "INSERT INTO product_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+        "CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN "
+        "INSERT INTO product_fts(product_fts, rowid, title, description) "
+        "VALUES ('delete', old.id, old.title, old.description); END",
+        "CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE ON product BEGIN "
+        "INSERT INTO product_fts(product_fts, rowid, title, description) "
+        "VALUES ('delete', old.id, old.title, old.description); "
+        "INSERT INTO product_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    ],
+}
+_fts_ready = None
+
+def create_search_index():
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite" and sqlite3.sqlite_version_info < (3, 34):
+        return  # no trigram tokenizer; search falls back to LIKE
+    # only index existing products when the FTS table is new; rebuilding takes a write lock
+    needs_rebuild = dialect == "sqlite" and not db.inspect(db.engine).has_table("product_fts")
+    try:
+        with db.engine.begin() as conn:
+            for stmt in _SEARCH_DDL.get(dialect, []):
+                conn.execute(db.text(stmt))
+            if needs_rebuild:
+                conn.execute(db.text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+    except DBAPIError as e:
+        if dialect != "postgresql":
+            raise
+        # e.g. managed roles that may not CREATE EXTENSION; search falls back to ILIKE
+        app.logger.warning("Skipping trigram search index: %s", e.orig)
+
+def search_filter(q):
+    global _fts_ready
+    if db.engine.dialect.name == "sqlite" and len(q) >= 3:  # trigram MATCH needs 3+ chars
+        if _fts_ready is None:
+            _fts_ready = db.inspect(db.engine).has_table("product_fts")
+        if _fts_ready:
+            phrase = '"' + q.replace('"', '""') + '"'
+            return Product.id.in_(
+                db.text("SELECT rowid FROM product_fts WHERE product_fts MATCH :phrase")
+                .bindparams(phrase=phrase).columns(db.column("rowid"))
+            )
+    pattern = f"%{q}%"
+    if db.engine.dialect.name == "sqlite":
+        # SQLite's LIKE is already case-insensitive (ASCII, same as its lower())
+        return db.or_(Product.title.like(pattern), Product.description.like(pattern))
+    return db.or_(Product.title.ilike(pattern), Product.description.ilike(pattern))
+
+def read_cart():
+    # read-only: doesn't touch the session, so GETs don't re-sign the cookie
+    return session.get("cart", {})  # {product_id: qty}
+
+def mut_cart():
+    session.modified = True
+    return session.setdefault("cart", {})
+
+def update_cart_count():
+    # stored alongside the cart so templates don't re-sum it on every render
+    session["cart_count"] = sum(read_cart().values())
 
 def cart_items():
-    c = get_cart()
-    ids = [int(pid) for pid in c.keys()]
-    products = Product.query.filter(Product.id.in_(ids)).all() if ids else []
+    c = read_cart()
+    if not c:
+        return [], 0.0
+    qty_by_id = {int(pid): qty for pid, qty in c.items()}  # parse session keys once
+    products = db.session.execute(
+        db.select(Product).options(joinedload(Product.category)).where(Product.id.in_(qty_by_id))
+    ).scalars().all()
     by_id = {p.id: p for p in products}
-    items = []
-    total = 0.0
-    for pid, qty in c.items():
-        p = by_id.get(int(pid))
-        if not p: 
-            continue
-        line_total = p.price * qty
-        total += line_total
-        items.append({"product": p, "qty": qty, "line_total": line_total})
+    items = [{"product": p, "qty": qty, "line_total": p.price * qty}
+             for pid, qty in qty_by_id.items() if (p := by_id.get(pid))]
+    total = sum((it["line_total"] for it in items), 0.0)
     return items, total
 
+def is_personalized():
+    # pages showing a user, a cart count or a flash message must not be served from cache
+    return current_user.is_authenticated or bool(read_cart()) or "_flashes" in session
+
 @app.context_processor
 def inject_cart_count():
-    cart = get_cart()
-    return {"cart_count": sum(cart.values())}
+    count = session.get("cart_count")
+    if count is None:  # sessions created before cart_count was stored
+        count = sum(read_cart().values())
+    return {"cart_count": count}
 
 # ------------------ Routes ------------------
 @app.route("/")
+@cache.cached(query_string=True, unless=is_personalized)
 def index():
     q = request.args.get("q","").strip()
     cat_id = request.args.get("category","")
-    categories = Category.query.order_by(Category.name).all()
-    products = Product.query
+    categories = get_categories()
+    # listing only needs card fields; skip hydrating full objects (and description)
+    products = (db.select(Product.id, Product.title, Product.price, Product.image_url,
+                          Product.category_id, Category.name.label("category_name"))
+                .outerjoin(Category, Product.category_id == Category.id))
     if q:
-        like = f"%{q.lower()}%"
-        products = products.filter(db.or_(db.func.lower(Product.title).like(like),
-                                          db.func.lower(Product.description).like(like)))
+        products = products.where(search_filter(q))
     if cat_id:
-        products = products.filter_by(category_id=cat_id)
-    products = products.order_by(Product.id.desc()).all()
+        products = products.where(Product.category_id == cat_id)
+    products = db.session.execute(products.order_by(Product.id.desc())).all()
     return render_template("index.html", products=products, categories=categories, q=q, cat_id=str(cat_id))
 
 @app.route("/product/<int:pid>")
 def product_detail(pid):
-    p = Product.query.get_or_404(pid)
+    p = db.session.get(Product, pid, options=[joinedload(Product.category)])
+    if p is None:
+        abort(404)
     return render_template("product_detail.html", p=p)
 
 @app.route("/add-to-cart/<int:pid>", methods=["POST"])
 def add_to_cart(pid):
     qty = int(request.form.get("qty", 1))
-    product = Product.query.get_or_404(pid)
-    cart = get_cart()
+    # only the title is needed for the flash; this also serves as the existence check
+    title = db.session.execute(db.select(Product.title).where(Product.id == pid)).scalar()
+    if title is None:
+        abort(404)
+    cart = mut_cart()
     cart[str(pid)] = cart.get(str(pid), 0) + max(1, qty)
-    session.modified = True
-    flash(f"Added {product.title} (x{qty}) to cart.", "success")
+    update_cart_count()
+    flash(f"Added {title} (x{qty}) to cart.", "success")
     return redirect(request.referrer or url_for("index"))
 
 @app.route("/cart", methods=["GET","POST"])
@@ -120,8 +295,9 @@ def cart_view():
         # update quantities or remove
         action = request.form.get("action")
         pid = request.form.get("pid")
-        cart = get_cart()
+        cart = mut_cart()
         if action == "update":
+            pid = str(int(pid))  # same key format as add_to_cart
             qty = max(0, int(request.form.get("qty", 1)))
             if qty == 0:
                 cart.pop(pid, None)
@@ -129,7 +305,7 @@ def cart_view():
                 cart[pid] = qty
         elif action == "clear":
             session["cart"] = {}
-        session.modified = True
+        update_cart_count()
     items, total = cart_items()
     return render_template("cart.html", items=items, total=total)
 
@@ -147,11 +323,12 @@ def checkout():
             "price": it["product"].price
         } for it in items]
         order = Order(user_id=current_user.id if current_user.is_authenticated else None,
-                      items_json=json.dumps(order_items),
+                      items_json=order_items,
                       total=total)
         db.session.add(order)
         db.session.commit()
         session["cart"] = {}
+        session["cart_count"] = 0
         flash(f"Order #{order.id} placed successfully!", "success")
         return redirect(url_for("index"))
     return render_template("checkout.html", items=items, total=total)
@@ -180,7 +357,18 @@ def login():
         email = request.form["email"].lower().strip()
         password = request.form["password"]
         user = User.query.filter_by(email=email).first()
-        if user and user.check_password(password):
+        if user:
+            ok = user.check_password(password)
+            if user.needs_rehash():
+                # stored cost differs from the current one; pay the current cost as well so
+                # known emails don't answer faster than unknown ones
+                bcrypt.check_password_hash(_DUMMY_HASH, password)
+        else:
+            ok = bcrypt.check_password_hash(_DUMMY_HASH, password)
+        if user and ok:
+            if user.needs_rehash():
+                user.set_password(password)
+                db.session.commit()
             login_user(user)
             flash("Welcome back!", "success")
             next_url = request.args.get("next")
@@ -200,6 +388,10 @@ def logout():
 def init_db():
     """Initialize database tables."""
     db.create_all()
+    # create_all skips existing tables, so add any indexes missing from older DBs
+    for index in Product.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    create_search_index()
     print("Initialized the database.")
 
 @app.cli.command("seed")
@@ -207,10 +399,9 @@ def seed():
     """Seed sample categories and products."""
     if not Category.query.first():
         categories = ["Electronics", "Clothing", "Books", "Home"]
-        cats = [Category(name=c) for c in categories]
-        db.session.add_all(cats); db.session.commit()
-    else:
-        cats = Category.query.all()
+        # one executemany INSERT instead of per-instance ORM flushes
+        db.session.execute(db.insert(Category), [{"name": c} for c in categories]); db.session.commit()
+        invalidate_categories()
     if not Product.query.first():
         import random
         sample = [
@@ -220,25 +411,17 @@ def seed():
             ("Stainless Water Bottle", "Insulated bottle keeps drinks cold for 24h.", 699.0, "https://picsum.photos/seed/bottle/600/400", "Home"),
             ("Programming Book", "Master Python with practical examples.", 899.0, "https://picsum.photos/seed/book/600/400", "Books"),
         ]
-        cat_by_name = {c.name: c for c in cats}
-        for title, desc, price, img, cname in sample:
-            db.session.add(Product(
-                title=title, description=desc, price=price, image_url=img, category=cat_by_name[cname]
-            ))
+        cat_id_by_name = dict(db.session.execute(db.select(Category.name, Category.id)).all())
+        rows = [{"title": title, "description": desc, "price": price, "image_url": img,
+                 "category_id": cat_id_by_name[cname]}
+                for title, desc, price, img, cname in sample]
+        db.session.execute(db.insert(Product), rows)
         db.session.commit()
+    # with SimpleCache this clears only the current process's page cache; running
+    # workers keep serving cached pages until PAGE_CACHE_TTL expires
+    cache.clear()
     print("Seeded data.")
-    
-if __name__ == "__main__":
-    # Temporary route to initialize and seed the database on Render free plan
-@app.route("/initdb")
-def initdb():
-    with app.app_context():
-        db.create_all()
-        # Call the seed function
-        try:
-            from app import seed
-            seed()
-            return "✅ Database initialized and seeded!"
-        except Exception as e:
-            return f"⚠ Error: {e}"
 
+if __name__ == "__main__":
+    # dev server only; production is served by gunicorn (see gunicorn.conf.py)
+    app.run(debug=True)
@@ -0,0 +1,8 @@
+import os
+
+# ------------- Gunicorn settings -------------
+# Used by: gunicorn -c gunicorn.conf.py app:app
+workers = int(os.getenv("WEB_CONCURRENCY", 2 * (os.cpu_count() or 1) + 1))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+keepalive = 30